@@ -1,12 +1,18 @@
 from dataclasses import dataclass
-from enum import Enum
+from enum import Enum, IntEnum
 from node import Node
 
 
-class RoleType(Enum):
-    OWNER = "owner"
-    VIEWER = "viewer"
-    EDITOR = "editor"
+class RoleType(IntEnum):
+    """Role granted by a HAS_ROLE edge (small ints for cheap hashing/compares)"""
+    OWNER = 0
+    VIEWER = 1
+    EDITOR = 2
+
+    @property
+    def label(self) -> str:
+        """Lower-case display name, e.g. 'owner'"""
+        return self.name.lower()
 
 
 class EdgeType(Enum):
@@ -15,21 +21,34 @@ class EdgeType(Enum):
     HAS_ROLE = "has_role"
 
 
-@dataclass(eq=True)
+@dataclass(eq=False, slots=True)
 class Edge:
     """
     Represents a directed relationship between two nodes in the graph
+    Edges compare and hash by (source id, target id, type), as node ids are
+    unique within a graph
     """
     source: Node
     target: Node
     type: EdgeType
 
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (self.source.id == other.source.id
+                and self.target.id == other.target.id
+                and self.type is other.type)
+
+    def __hash__(self):
+        return hash((self.source.id, self.target.id, self.type))
+
     def __str__(self):
         return f"{self.source.id} -[{self.type.value}]-> {self.target.id}"
 
 
 class ParentOfEdge(Edge):
     """Represents parent-child relationship between resources"""
+    __slots__ = ()
 
     def __init__(self, parent: Node, child: Node):
         super().__init__(source=parent, target=child, type=EdgeType.PARENT_OF)
@@ -37,6 +56,7 @@ class ParentOfEdge(Edge):
 
 class HasRoleEdge(Edge):
     """Represents role assignment of an identity on a resource"""
+    __slots__ = ("role",)
     role: RoleType
 
     def __init__(self, identity: Node, resource: Node, role: RoleType):
@@ -44,6 +64,14 @@ class HasRoleEdge(Edge):
                          type=EdgeType.HAS_ROLE)
         self.role = role
 
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return Edge.__eq__(self, other) and self.role is other.role
+
+    def __hash__(self):
+        return hash((self.source.id, self.target.id, self.type, self.role))
+
     def __str__(self):
-        return f"{self.source.id} -[{self.type.value}:{self.role}]-> " \
+        return f"{self.source.id} -[{self.type.value}:{self.role.name}]-> " \
                f"{self.target.id}"
@@ -1,16 +1,30 @@
+import io
 import logging
-from collections import deque, defaultdict
+import sys
+from array import array
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Dict, List, Tuple, TypeAlias, Optional, Iterator
+from typing import Dict, Iterable, List, Set, Tuple, TypeAlias, Optional, Iterator
 from edge import Edge, EdgeType, HasRoleEdge, RoleType
 from node import Node, NodeNotFoundError
 
+logger = logging.getLogger(__name__)
+
 NodeId: TypeAlias = str
 SourceNodeId: TypeAlias = str
 TargetNodeId: TypeAlias = str
 
+# shared empty adjacency returned on lookup misses (no per-miss allocation)
+_EMPTY: tuple = ()
+
+# default budget of the descendant memo, in cached node references
+DEFAULT_DESCENDANTS_CACHE_SIZE = 100_000
+
+# precomputed indentation for print_resource_tree
+_INDENTS: List[str] = [" " * i for i in range(64)]
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, slots=True)
 class PermissionEntry:
     resource_id: str
     resource_type: str
@@ -24,14 +38,50 @@ class Graph:
     O(1) lookup for nodes and their incoming/outgoing edges
     """
 
-    def __init__(self):
+    def __init__(self, enforce_dag: bool = False,
+                 descendants_cache_size: int = DEFAULT_DESCENDANTS_CACHE_SIZE):
         self.nodes: Dict[NodeId, Node] = {}
 
+        # reject PARENT_OF edges that would close a cycle in the hierarchy
+        self._enforce_dag = enforce_dag
+
         # outgoing edges per source node
-        self.out_edges: Dict[SourceNodeId, List[Edge]] = defaultdict(list)
+        self.out_edges: Dict[SourceNodeId, List[Edge]] = {}
 
         # incoming edges per target node
-        self.in_edges: Dict[TargetNodeId, List[Edge]] = defaultdict(list)
+        self.in_edges: Dict[TargetNodeId, List[Edge]] = {}
+
+        # per-type adjacency used by the traversal hot paths, so they never
+        # have to filter edges by type
+        self.out_parent: Dict[SourceNodeId, List[Node]] = {}
+        self.in_parent: Dict[TargetNodeId, List[Node]] = {}
+        self.out_role: Dict[SourceNodeId, List[HasRoleEdge]] = {}
+
+        # materialized descendants per resource, invalidated on PARENT_OF
+        # insertion for the parent and all of its ancestors. Kept as an LRU
+        # bounded by the total number of cached node references (each entry
+        # also counts one for itself), since subtree tuples make the
+        # unbounded memo grow as O(V^2)
+        self._descendants_cache: OrderedDict[NodeId, Tuple[Node, ...]] = \
+            OrderedDict()
+        self._descendants_cache_size = descendants_cache_size
+        self._descendants_cached = 0
+
+        # precompiled permission closure: identity -> granted (resource, role)
+        # entries; None until rebuild_permissions_index() is called, then kept
+        # up to date by add_edge
+        self._identity_perms: Optional[
+            Dict[NodeId, Dict[Tuple[NodeId, RoleType], PermissionEntry]]] = None
+
+        # shared immutable permission entries per (resource, role)
+        self._perm_intern: Dict[Tuple[NodeId, RoleType], PermissionEntry] = {}
+
+        # optional transitive closure built by build_closure(), dropped on any
+        # mutation: per node index, an int bitset of the indices of all its
+        # descendants (a node on a cycle is its own descendant)
+        self._id2ix: Dict[NodeId, int] = {}
+        self._ix2node: List[Node] = []
+        self._closure: List[int] = []
 
     # -------------------- Node Management --------------------
 
@@ -39,6 +89,7 @@ class Graph:
         """Add a node if it does not already exist"""
         if node.id not in self.nodes:
             self.nodes[node.id] = node
+            self._drop_closure()
 
     def get_node(self, node_id: str) -> Optional[Node]:
         """Return a node by its ID, or None if not found"""
@@ -47,112 +98,510 @@ class Graph:
     # -------------------- Edge Management --------------------
 
     def add_edge(self, edge: Edge) -> None:
-        """Add an edge between existing nodes"""
+        """
+        Add an edge between existing nodes
+        When the graph enforces a DAG, PARENT_OF edges closing a cycle are rejected
+        """
         if edge.source.id not in self.nodes or edge.target.id not in self.nodes:
             raise ValueError("source and target nodes must exist before "
                              "adding an edge")
-        self.out_edges[edge.source.id].append(edge)
-        self.in_edges[edge.target.id].append(edge)
+        if self._enforce_dag and edge.type is EdgeType.PARENT_OF and (
+                edge.source.id == edge.target.id
+                or self.is_descendant(edge.source.id, edge.target.id)):
+            raise ValueError(f"edge {edge} would create a cycle in the "
+                             f"resource hierarchy")
+        self._drop_closure()
+        self.out_edges.setdefault(edge.source.id, []).append(edge)
+        self.in_edges.setdefault(edge.target.id, []).append(edge)
+
+        if edge.type is EdgeType.PARENT_OF:
+            self.out_parent.setdefault(edge.source.id, []).append(edge.target)
+            self.in_parent.setdefault(edge.target.id, []).append(edge.source)
+            self._invalidate_descendants(edge.source.id)
+        elif edge.type is EdgeType.HAS_ROLE:
+            self.out_role.setdefault(edge.source.id, []).append(edge)
+
+        if self._identity_perms is not None:
+            self._index_edge(edge)
 
     def iter_out_edges(self, node_id: str) -> Iterator[Edge]:
-        """Yield all outgoing edges from the given node"""
-        for edge in self.out_edges.get(node_id, []):
-            yield edge
+        """Return an iterator over all outgoing edges from the given node"""
+        return iter(self.out_edges.get(node_id, _EMPTY))
 
     def iter_in_edges(self, node_id: str) -> Iterator[Edge]:
-        """Yield all incoming edges to the given node"""
-        for edge in self.in_edges.get(node_id, []):
-            yield edge
+        """Return an iterator over all incoming edges to the given node"""
+        return iter(self.in_edges.get(node_id, _EMPTY))
+
+    # -------------------- Permissions Index --------------------
+
+    def rebuild_permissions_index(self) -> None:
+        """
+        Precompute the inherited permissions of every identity in one pass.
+        Afterwards add_edge keeps the index up to date incrementally and
+        iter_user_permissions no longer traverses the hierarchy.
+        Meant for bulk loads: build the graph first, then index it once.
+        """
+        self._identity_perms = None
+        index = {}
+        for identity_id in self.out_role:
+            index[identity_id] = {
+                (entry.resource_id, entry.role): entry
+                for entry in self.iter_user_permissions(identity_id)
+            }
+        self._identity_perms = index
+
+    def _index_edge(self, edge: Edge) -> None:
+        """Propagate a newly added edge into the permissions index"""
+        if edge.type is EdgeType.HAS_ROLE:
+            grants = [(edge.source.id, edge.role, edge.target.id)]
+        elif edge.type is EdgeType.PARENT_OF:
+            # every grant on the parent or any of its ancestors now also
+            # covers the child's subtree
+            child_id = edge.target.id
+            grants = [
+                (role_edge.source.id, role_edge.role, child_id)
+                for resource in (edge.source,
+                                 *self.iter_resource_hierarchy(edge.source.id))
+                for role_edge in self.in_edges.get(resource.id, _EMPTY)
+                if role_edge.type is EdgeType.HAS_ROLE
+            ]
+        else:
+            return
+
+        for identity_id, role, root_id in grants:
+            perms = self._identity_perms.setdefault(identity_id, {})
+            for node in (self.nodes[root_id], *self._walk_descendants(root_id)):
+                key = (node.id, role)
+                if key not in perms:
+                    perms[key] = self._permission_entry(node, role)
+
+    # -------------------- Transitive Closure --------------------
+
+    def build_closure(self) -> None:
+        """
+        Precompute a descendant bitset per node, making is_descendant a single
+        bit test. The hierarchy is first laid out as int-indexed CSR arrays,
+        which only live for the duration of the build.
+        The closure costs O(V^2 / 8) bytes, so it is only worth it for graphs
+        up to ~10^4 nodes. Any subsequent add_node/add_edge discards it.
+        """
+        ix2node = list(self.nodes.values())
+        id2ix = {node.id: ix for ix, node in enumerate(ix2node)}
+        off, dst = _build_csr(ix2node, id2ix, self.out_parent)
+        rev_off, rev_dst = _build_csr(ix2node, id2ix, self.in_parent)
+
+        self._closure = _build_closure(off, dst, rev_off, rev_dst)
+        self._id2ix, self._ix2node = id2ix, ix2node
+
+    def _drop_closure(self) -> None:
+        """Discard the transitive closure (called on every mutation)"""
+        if self._closure:
+            self._closure = []
+            self._id2ix, self._ix2node = {}, []
 
     # -------------------- Utils Methods --------------------
 
     def iter_children(self, node_id: str) -> Iterator[Node]:
-        """Yield all direct child nodes (PARENT_OF edges only)"""
-        for edge in self.out_edges.get(node_id, []):
-            if edge.type == EdgeType.PARENT_OF:
-                yield edge.target
+        """Return an iterator over direct child nodes (PARENT_OF edges only)"""
+        return iter(self.out_parent.get(node_id, _EMPTY))
+
+    def _invalidate_descendants(self, node_id: str) -> None:
+        """Drop cached descendants of a node and of all its ancestors"""
+        if not self._descendants_cache:
+            return
+        self._evict_descendants(node_id)
+        for ancestor in self.iter_resource_hierarchy(node_id):
+            self._evict_descendants(ancestor.id)
+
+    def _evict_descendants(self, node_id: str) -> None:
+        """Remove one memoized descendant tuple, if present"""
+        descendants = self._descendants_cache.pop(node_id, None)
+        if descendants is not None:
+            self._descendants_cached -= len(descendants) + 1
+
+    def clear_cache(self) -> None:
+        """Evict all memoized traversal results and shared permission entries"""
+        self._descendants_cache.clear()
+        self._descendants_cached = 0
+        self._perm_intern.clear()
+
+    def _permission_entry(self, node: Node, role: RoleType) -> PermissionEntry:
+        """Return the shared PermissionEntry for (node, role), creating it once"""
+        key = (node.id, role)
+        entry = self._perm_intern.get(key)
+        if entry is None:
+            entry = self._perm_intern[key] = PermissionEntry(
+                resource_id=node.id,
+                resource_type=node.inner_type,
+                role=role,
+            )
+        return entry
 
     def _iter_descendants(self, node_id: str) -> Iterator[Node]:
-        """Depth-first traversal yielding all descendant nodes recursively"""
-        for child in self.iter_children(node_id):
-            yield child
-            # recurse lazily – yields grandchildren as well
-            yield from self._iter_descendants(child.id)
+        """Return an iterator over all descendant nodes (memoized per node, LRU)"""
+        cache = self._descendants_cache
+        descendants = cache.get(node_id)
+        if descendants is not None:
+            cache.move_to_end(node_id)
+        else:
+            ix = self._id2ix.get(node_id) if self._closure else None
+            if ix is not None:
+                # the node itself is never reported, even on a cycle
+                descendants = tuple(
+                    map(self._ix2node.__getitem__,
+                        _iter_bits(self._closure[ix] & ~(1 << ix))))
+            else:
+                descendants = tuple(self._walk_descendants(node_id))
+            cost = len(descendants) + 1
+            if cost <= self._descendants_cache_size:
+                cache[node_id] = descendants
+                self._descendants_cached += cost
+                while self._descendants_cached > self._descendants_cache_size:
+                    _, evicted = cache.popitem(last=False)
+                    self._descendants_cached -= len(evicted) + 1
+        return iter(descendants)
+
+    def is_descendant(self, node_id: str, ancestor_id: str) -> bool:
+        """
+        Return True if node_id is reachable from ancestor_id via PARENT_OF
+        A node is its own descendant only when it lies on a cycle
+        """
+        if self._closure:
+            ix = self._id2ix.get(node_id)
+            ancestor_ix = self._id2ix.get(ancestor_id)
+            if ix is None or ancestor_ix is None:
+                return False
+            return bool(self._closure[ancestor_ix] >> ix & 1)
+        return self._has_path(ancestor_id, node_id)
+
+    def _has_path(self, from_id: str, to_id: str) -> bool:
+        """
+        Return True if to_id is reachable from from_id via PARENT_OF edges.
+        Early-exit DFS that does not touch the descendant cache.
+        """
+        visited = {from_id}
+        stack: List[NodeId] = [from_id]
+        while stack:
+            for child in self.out_parent.get(stack.pop(), _EMPTY):
+                child_id = child.id
+                if child_id == to_id:
+                    return True
+                if child_id in visited:
+                    continue
+                visited.add(child_id)
+                stack.append(child_id)
+        return False
+
+    def _walk_descendants(self, node_id: str,
+                          visited: Optional[Set[NodeId]] = None) -> Iterator[Node]:
+        """
+        Depth-first traversal yielding all descendant nodes (explicit stack).
+        Each descendant is yielded once, even when reachable via several paths.
+        A caller-provided visited set (which must already contain node_id) is
+        updated in place, and subtrees rooted at its members are pruned.
+        """
+        if visited is None:
+            visited = {node_id}
+        stack: List[NodeId] = [node_id]
+        while stack:
+            current_id = stack.pop()
+            for child in self.out_parent.get(current_id, _EMPTY):
+                if child.id in visited:
+                    continue
+                visited.add(child.id)
+                yield child
+                stack.append(child.id)
 
     def iter_parents(self, node_id: str) -> Iterator[Node]:
-        """Yield all parent nodes for a given child node (PARENT_OF edges only)"""
-        for edge in self.in_edges.get(node_id, []):
-            if edge.type == EdgeType.PARENT_OF:
-                yield edge.source
+        """Return an iterator over parent nodes (PARENT_OF edges only)"""
+        return iter(self.in_parent.get(node_id, _EMPTY))
 
     def __str__(self):
-        return "\n".join(
-            [f"{src} -> {[str(e) for e in edges]}" for src, edges in self.out_edges.items()]
-        )
+        buf = io.StringIO()
+        for i, (src, edges) in enumerate(self.out_edges.items()):
+            if i:
+                buf.write("\n")
+            buf.write(src)
+            buf.write(" -> [")
+            for j, edge in enumerate(edges):
+                if j:
+                    buf.write(", ")
+                buf.write(str(edge))
+            buf.write("]")
+        return buf.getvalue()
 
     def print_resource_tree(self, root_id: NodeId, spaces: int = 0) -> None:
-        """Recursively print the resource hierarchy as an indented tree"""
+        """
+        Print the resource hierarchy as an indented tree (single write)
+        A child that points back to a node on the current path (a cycle) is skipped
+        """
         node: Optional[Node] = self.get_node(root_id)
         if not node:
             raise NodeNotFoundError(root_id)
 
-        print(" " * spaces + f"- {node.id}")
-        for child in self.iter_children(root_id):
-            self.print_resource_tree(child.id, spaces + 4)
+        lines: List[str] = []
+        # ids from the root down to the node being printed, and the same as a set
+        path: List[NodeId] = []
+        on_path: Set[NodeId] = set()
+        stack: List[Tuple[Node, int]] = [(node, 0)]
+        while stack:
+            node, level = stack.pop()
+            on_path.difference_update(path[level:])
+            del path[level:]
+            path.append(node.id)
+            on_path.add(node.id)
+
+            depth = spaces + 4 * level
+            indent = _INDENTS[depth] if depth < len(_INDENTS) else " " * depth
+            lines.append(f"{indent}- {node.id}\n")
+            # push children reversed so they are printed in insertion order
+            children = list(self.iter_children(node.id))
+            for child in reversed(children):
+                if child.id not in on_path:
+                    stack.append((child, level + 1))
+        sys.stdout.write("".join(lines))
 
     # Task 2
     def iter_resource_hierarchy(self, resource_id: str) -> Iterator[Node]:
         """
         Yield all ancestor resource IDs for a given resource.
         Supports multiple parents and avoids infinite loops.
-        Traverses upwards in the resource graph (BFS style).
+        Traverses upwards in the resource graph (DFS style, explicit stack).
         """
-        visited = set()
-        queue = deque([resource_id])
+        visited = {resource_id}
+        stack: List[NodeId] = [resource_id]
 
-        while queue:
-            current_id = queue.popleft()
-            for parent in self.iter_parents(current_id):
+        while stack:
+            current_id = stack.pop()
+            for parent in self.in_parent.get(current_id, _EMPTY):
                 if parent.id in visited:
                     continue
                 visited.add(parent.id)
                 yield parent
-                queue.append(parent.id)
+                stack.append(parent.id)
 
     # Task 3
     def iter_user_permissions(self, node_identity_id: str) -> Iterator[PermissionEntry]:
         """
         Yield permissions (resource_id, resource_type, role) for a given identity
         Includes permissions inherited down the resource hierarchy
-        Time complexity: O(V + E) - each node and edge visited once (DFS traversal)
+        Each (resource, role) pair is yielded once, even for overlapping subtrees
+        Time complexity: O(V + E) per distinct role - subtrees already granted
+        with the same role are pruned from the DFS traversal
         """
         identity_node: Optional[Node] = self.get_node(node_identity_id)
         if not identity_node:
             raise NodeNotFoundError(node_identity_id)
 
-        # Get all outgoing HAS_ROLE edges for this identity
-        for edge in self.iter_out_edges(node_identity_id):
-            if edge.type != EdgeType.HAS_ROLE:
-                continue
+        if self._identity_perms is not None:
+            perms = self._identity_perms.get(node_identity_id)
+            if perms:
+                # snapshot, so the graph may be mutated while iterating
+                yield from tuple(perms.values())
+            return
 
+        # resources already granted, per role
+        seen: Dict[RoleType, Set[NodeId]] = {}
+
+        # Get all outgoing HAS_ROLE edges for this identity
+        for edge in self.out_role.get(node_identity_id, _EMPTY):
             target_resource: Node = edge.target
-            edge: HasRoleEdge  # type hint
             role = edge.role
-            logging.debug(
-                f"User {identity_node.id} has role {role} on {target_resource.id}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("User %s has role %s on %s",
+                             identity_node.id, role.name, target_resource.id)
+
+            role_seen = seen.get(role)
+            if role_seen is None:
+                role_seen = seen[role] = set()
+            # an already granted resource implies its whole subtree was
+            # granted with the same role as well - prune it
+            if target_resource.id in role_seen:
+                continue
+
+            if role_seen:
+                # overlapping grants: walk only the parts not granted yet
+                role_seen.add(target_resource.id)
+                descendants = self._walk_descendants(target_resource.id,
+                                                     role_seen)
+            else:
+                # first grant of this role: the memoized subtree is disjoint
+                role_seen.add(target_resource.id)
+                descendants = self._iter_descendants(target_resource.id)
 
             # yield direct permission
-            yield PermissionEntry(
-                resource_id=target_resource.id,
-                resource_type=target_resource.inner_type,
-                role=role,
-            )
+            yield self._permission_entry(target_resource, role)
 
             # yield inherited permissions (descendants)
-            for descendant_node in self._iter_descendants(
-                    target_resource.id):
-                yield PermissionEntry(
-                    resource_id=descendant_node.id,
-                    resource_type=descendant_node.inner_type,
-                    role=role,
-                )
+            for descendant_node in descendants:
+                role_seen.add(descendant_node.id)
+                yield self._permission_entry(descendant_node, role)
+
+    def iter_user_permissions_many(self, identity_ids: List[str]
+                                   ) -> Iterator[Tuple[str, PermissionEntry]]:
+        """
+        Yield (identity_id, permission) pairs for a batch of identities
+        HAS_ROLE targets of all identities are grouped by resource and visited
+        ancestors first, so every resource is traversed at most once per
+        (identity, role) and nested roots are pruned
+        Duplicate ids in identity_ids are reported once
+        """
+        identity_ids = list(dict.fromkeys(identity_ids))
+
+        if self._identity_perms is not None:
+            for identity_id in identity_ids:
+                for entry in self.iter_user_permissions(identity_id):
+                    yield identity_id, entry
+            return
+
+        # resource root -> (identity, role) labels granted on it
+        roots: Dict[NodeId, List[Tuple[str, RoleType]]] = {}
+        for identity_id in identity_ids:
+            if identity_id not in self.nodes:
+                raise NodeNotFoundError(identity_id)
+            for edge in self.out_role.get(identity_id, _EMPTY):
+                labels = roots.setdefault(edge.target.id, [])
+                label = (identity_id, edge.role)
+                if label not in labels:
+                    labels.append(label)
+
+        # resources already granted per (identity, role); once a resource is
+        # in a set, its whole subtree is as well
+        covered: Dict[Tuple[str, RoleType], Set[NodeId]] = {}
+        depths = self._resource_depths(roots)
+        # ancestors first, so nested roots are reached through their
+        # ancestors' walks and pruned
+        for root_id in sorted(roots, key=depths.__getitem__):
+            active = [label for label in roots[root_id]
+                      if root_id not in covered.get(label, _EMPTY)]
+            if not active:
+                continue
+            granted = [covered.setdefault(label, set()) for label in active]
+            root = self.nodes[root_id]
+
+            if not any(granted):
+                # first grant for every label: the memoized subtree is disjoint
+                for node in (root, *self._iter_descendants(root_id)):
+                    for (identity_id, role), label_granted in zip(active, granted):
+                        label_granted.add(node.id)
+                        yield identity_id, self._permission_entry(node, role)
+                continue
+
+            # overlapping grants: walk once for all labels, pruning subtrees
+            # already granted to every one of them
+            visited = {root_id}
+            stack: List[Node] = [root]
+            while stack:
+                node = stack.pop()
+                pending = [(label, label_granted)
+                           for label, label_granted in zip(active, granted)
+                           if node.id not in label_granted]
+                if not pending:
+                    continue
+                for (identity_id, role), label_granted in pending:
+                    label_granted.add(node.id)
+                    yield identity_id, self._permission_entry(node, role)
+                for child in self.out_parent.get(node.id, _EMPTY):
+                    if child.id not in visited:
+                        visited.add(child.id)
+                        stack.append(child)
+
+    def _resource_depths(self, resource_ids: Iterable[NodeId]) -> Dict[NodeId, int]:
+        """
+        Longest PARENT_OF distance from a top-level resource, for the given
+        resources and their ancestors (a strict ancestor always has a smaller
+        depth unless both lie on a cycle). Iterative, memoized post-order.
+        """
+        depths: Dict[NodeId, int] = {}
+        on_stack: Set[NodeId] = set()
+        for start_id in resource_ids:
+            if start_id in depths:
+                continue
+            stack: List[Tuple[NodeId, bool]] = [(start_id, False)]
+            while stack:
+                node_id, expanded = stack.pop()
+                parents = self.in_parent.get(node_id, _EMPTY)
+                if expanded:
+                    on_stack.discard(node_id)
+                    # parents still on the stack close a cycle: count them as 0
+                    depths[node_id] = max(
+                        (depths.get(p.id, 0) + 1 for p in parents), default=0)
+                    continue
+                if node_id in depths or node_id in on_stack:
+                    continue
+                on_stack.add(node_id)
+                stack.append((node_id, True))
+                for parent in parents:
+                    if parent.id not in depths and parent.id not in on_stack:
+                        stack.append((parent.id, False))
+        return depths
+
+
+def _build_csr(ix2node: List[Node], id2ix: Dict[NodeId, int],
+               adjacency: Dict[NodeId, List[Node]]) -> Tuple[array, array]:
+    """Build (offsets, destinations) int arrays from a node adjacency dict"""
+    off, dst = array("i", [0]), array("i")
+    for node in ix2node:
+        for neighbour in adjacency.get(node.id, _EMPTY):
+            dst.append(id2ix[neighbour.id])
+        off.append(len(dst))
+    return off, dst
+
+
+def _build_closure(off: array, dst: array,
+                   rev_off: array, rev_dst: array) -> List[int]:
+    """
+    Per-node descendant bitsets (Python ints) over a CSR adjacency.
+    Nodes are merged in reverse topological order (Kahn on out-degree), so
+    each node ORs in its children's finished sets; nodes that cannot be
+    ordered because they reach a cycle fall back to a direct traversal.
+    """
+    n = len(off) - 1
+    closure = [0] * n
+    pending = array("i", (off[v + 1] - off[v] for v in range(n)))
+
+    ready = [v for v in range(n) if not pending[v]]
+    done = bytearray(n)
+    while ready:
+        v = ready.pop()
+        done[v] = 1
+        bits = 0
+        for i in range(off[v], off[v + 1]):
+            child = dst[i]
+            bits |= closure[child] | (1 << child)
+        closure[v] = bits
+        for i in range(rev_off[v], rev_off[v + 1]):
+            parent = rev_dst[i]
+            pending[parent] -= 1
+            if not pending[parent]:
+                ready.append(parent)
+
+    for v in range(n):
+        if done[v]:
+            continue
+        # direct DFS over the CSR slices for nodes that reach a cycle
+        bits = 0
+        visited = {v}
+        stack = [v]
+        while stack:
+            current = stack.pop()
+            for nxt in dst[off[current]:off[current + 1]]:
+                if nxt == v:
+                    # v lies on a cycle, so it is its own descendant
+                    bits |= 1 << v
+                    continue
+                if nxt in visited:
+                    continue
+                visited.add(nxt)
+                bits |= 1 << nxt
+                stack.append(nxt)
+        closure[v] = bits
+    return closure
+
+
+def _iter_bits(bits: int) -> Iterator[int]:
+    """Yield the indices of the set bits of an int bitset, lowest first"""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
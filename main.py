@@ -61,6 +61,6 @@ if __name__ == "__main__":
     found = False
     for permission in graph.iter_user_permissions(USER):
         found = True
-        print(f"{permission.resource_id:<15} | {permission.resource_type:<10} | {permission.role.value:<10}")
+        print(f"{permission.resource_id:<15} | {permission.resource_type:<10} | {permission.role.label:<10}")
     if not found:
         print("No permissions found.")
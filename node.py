@@ -1,3 +1,4 @@
+import sys
 from enum import Enum
 from dataclasses import dataclass
 
@@ -24,7 +25,7 @@ class ResourceType(Enum):
     PROJECT = "Project"
 
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class Node:
     """
     Base class representing a graph node
@@ -37,12 +38,18 @@ class Node:
     inner_type: str
     id: str
 
+    def __post_init__(self):
+        # interned ids hash/compare by pointer in the graph's adjacency dicts
+        object.__setattr__(self, "id", sys.intern(self.id))
+        object.__setattr__(self, "inner_type", sys.intern(self.inner_type))
+
     def __str__(self):
         return f"{self.type.value}:{self.inner_type}:{self.id}"
 
 
 class IdentityNode(Node):
     """Represents an identity (user, service account, group)"""
+    __slots__ = ()
 
     def __init__(self, identity_id: str, inner_type: IdentityType):
         super().__init__(type=NodeType.IDENTITY,
@@ -52,6 +59,7 @@ class IdentityNode(Node):
 
 class ResourceNode(Node):
     """Represents a resource entity (Folder, Project, Organization)"""
+    __slots__ = ()
 
     def __init__(self, resource_id: str, inner_type: ResourceType):
         super().__init__(type=NodeType.RESOURCE,
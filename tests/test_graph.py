@@ -1,3 +1,7 @@
+import logging
+import pickle
+import sys
+
 import pytest
 from graph import Graph
 from edge import ParentOfEdge, HasRoleEdge, EdgeType, RoleType
@@ -48,6 +52,59 @@ def test_add_edge_validation(graph):
         g.add_edge(ParentOfEdge(org, fake_folder))
 
 
+def test_node_ids_are_interned():
+    node_id = "".join(["folder", "_", "42"])
+    node = ResourceNode(node_id, ResourceType.FOLDER)
+    assert node.id is sys.intern("folder_42")
+    assert node.inner_type is sys.intern("Folder")
+
+
+def test_role_type_is_int_backed(graph):
+    _, _, folder, _, user = graph
+    assert RoleType.OWNER == 0 and RoleType.VIEWER.label == "viewer"
+    assert str(HasRoleEdge(user, folder, RoleType.EDITOR)) == \
+        "adi@test.com -[has_role:EDITOR]-> folder_1"
+
+
+def test_edge_equality_and_hash(graph):
+    _, org, folder, _, user = graph
+    same_org = ResourceNode("org_1", ResourceType.ORGANIZATION)
+    assert ParentOfEdge(org, folder) == ParentOfEdge(same_org, folder)
+    assert len({ParentOfEdge(org, folder), ParentOfEdge(same_org, folder)}) == 1
+    assert HasRoleEdge(user, folder, RoleType.OWNER) != \
+        HasRoleEdge(user, folder, RoleType.VIEWER)
+    assert ParentOfEdge(org, folder) != ParentOfEdge(folder, org)
+
+
+def test_nodes_and_edges_use_slots(graph):
+    g, _, folder, project, user = graph
+    role_edge = HasRoleEdge(user, folder, RoleType.OWNER)
+    for obj in (folder, user, ParentOfEdge(folder, project), role_edge):
+        assert not hasattr(obj, "__dict__")
+        assert pickle.loads(pickle.dumps(obj)) == obj
+    assert pickle.loads(pickle.dumps(role_edge)).role is RoleType.OWNER
+
+
+def test_add_edge_rejects_cycles_when_enforced():
+    g = Graph(enforce_dag=True)
+    org = ResourceNode("org_1", ResourceType.ORGANIZATION)
+    folder = ResourceNode("folder_1", ResourceType.FOLDER)
+    project = ResourceNode("project_1", ResourceType.PROJECT)
+    for node in [org, folder, project]:
+        g.add_node(node)
+    g.add_edge(ParentOfEdge(org, folder))
+    g.add_edge(ParentOfEdge(folder, project))
+    g.add_edge(ParentOfEdge(org, project))  # diamond is fine
+
+    with pytest.raises(ValueError):
+        g.add_edge(ParentOfEdge(project, org))
+    with pytest.raises(ValueError):
+        g.add_edge(ParentOfEdge(folder, folder))
+    assert list(g.iter_parents(org.id)) == []
+    # the cycle check must not fill the descendant memo
+    assert g._descendants_cache == {}
+
+
 # -------------------- Edge Iterators --------------------
 
 def test_iter_out_edges(graph):
@@ -64,6 +121,14 @@ def test_iter_in_edges(graph):
     assert all(e.type == EdgeType.PARENT_OF for e in in_edges)
 
 
+def test_edge_lookup_miss_does_not_populate(graph):
+    g, *_ = graph
+    assert list(g.iter_out_edges("ghost")) == []
+    assert list(g.iter_in_edges("ghost")) == []
+    assert list(g.iter_children("ghost")) == []
+    assert "ghost" not in g.out_edges and "ghost" not in g.in_edges
+
+
 # -------------------- Hierarchy traversal --------------------
 
 def test_iter_children(graph):
@@ -72,6 +137,12 @@ def test_iter_children(graph):
     assert len(children) == 1 and children[0].id == folder.id
 
 
+def test_iter_children_ignores_role_edges(graph):
+    g, _, folder, _, user = graph
+    assert list(g.iter_children(user.id)) == []
+    assert [e.target.id for e in g.out_role[user.id]] == [folder.id]
+
+
 def test_iter_parents(graph):
     g, org, folder, _, _ = graph
     parents = list(g.iter_parents(folder.id))
@@ -85,12 +156,66 @@ def test_iter_descendants(graph):
     assert "folder_1" in ids and "project_1" in ids
 
 
+def test_iter_descendants_deep_hierarchy():
+    g = Graph()
+    depth = 5000
+    nodes = [ResourceNode(f"folder_{i}", ResourceType.FOLDER)
+             for i in range(depth)]
+    for node in nodes:
+        g.add_node(node)
+    for parent, child in zip(nodes, nodes[1:]):
+        g.add_edge(ParentOfEdge(parent, child))
+    assert len(list(g._iter_descendants(nodes[0].id))) == depth - 1
+
+
+def test_iter_descendants_cache_invalidation(graph):
+    g, org, _, project, _ = graph
+    assert [n.id for n in g._iter_descendants(project.id)] == []
+    assert "task_1" not in [n.id for n in g._iter_descendants(org.id)]
+
+    task = ResourceNode("task_1", ResourceType.PROJECT)
+    g.add_node(task)
+    g.add_edge(ParentOfEdge(project, task))
+    assert [n.id for n in g._iter_descendants(project.id)] == ["task_1"]
+    assert "task_1" in [n.id for n in g._iter_descendants(org.id)]
+
+    g.clear_cache()
+    assert g._descendants_cache == {}
+
+
+def test_iter_descendants_cache_is_bounded():
+    g = Graph(descendants_cache_size=50)
+    nodes = [ResourceNode(f"folder_{i}", ResourceType.FOLDER)
+             for i in range(40)]
+    for node in nodes:
+        g.add_node(node)
+    for parent, child in zip(nodes, nodes[1:]):
+        g.add_edge(ParentOfEdge(parent, child))
+
+    for node in nodes:
+        expected = len(nodes) - nodes.index(node) - 1
+        assert len(list(g._iter_descendants(node.id))) == expected
+        cached = sum(len(d) + 1 for d in g._descendants_cache.values())
+        assert cached == g._descendants_cached <= 50
+    # the most recently used entries are the ones kept
+    assert nodes[-1].id in g._descendants_cache
+    assert nodes[0].id not in g._descendants_cache
+
+
 def test_iter_resource_hierarchy(graph):
     g, org, folder, project, _ = graph
     hierarchy = [n.id for n in g.iter_resource_hierarchy(project.id)]
     assert hierarchy == ["folder_1", "org_1"]
 
 
+def test_iter_resource_hierarchy_diamond_and_cycle(graph):
+    g, org, folder, project, _ = graph
+    g.add_edge(ParentOfEdge(org, project))
+    g.add_edge(ParentOfEdge(project, org))
+    hierarchy = [n.id for n in g.iter_resource_hierarchy(project.id)]
+    assert sorted(hierarchy) == ["folder_1", "org_1"]
+
+
 def test_iter_resource_hierarchy_no_parents(graph):
     g, org, _, _, _ = graph
     assert list(g.iter_resource_hierarchy(org.id)) == []
@@ -111,12 +236,189 @@ def test_iter_user_permissions_inherited(graph):
     assert "folder_1" in ids and "project_1" in ids  # inherited
 
 
+def test_iter_user_permissions_reuses_entries(graph):
+    g, _, folder, _, user = graph
+    first = list(g.iter_user_permissions(user.id))
+    second = list(g.iter_user_permissions(user.id))
+    assert all(a is b for a, b in zip(first, second))
+
+
+def test_iter_user_permissions_overlapping_subtrees(graph):
+    g, org, folder, project, user = graph
+    # diamond: org -> folder -> project and org -> project
+    g.add_edge(ParentOfEdge(org, project))
+    g.add_edge(HasRoleEdge(user, org, RoleType.OWNER))
+    g.add_edge(HasRoleEdge(user, project, RoleType.VIEWER))
+
+    perms = [(p.resource_id, p.role)
+             for p in g.iter_user_permissions(user.id)]
+    assert len(perms) == len(set(perms))
+    assert set(perms) == {
+        ("folder_1", RoleType.OWNER),
+        ("project_1", RoleType.OWNER),
+        ("org_1", RoleType.OWNER),
+        ("project_1", RoleType.VIEWER),
+    }
+
+
+def test_iter_user_permissions_many(graph):
+    g, org, folder, _, user = graph
+    group = IdentityNode("admins", IdentityType.GROUP)
+    g.add_node(group)
+    g.add_edge(HasRoleEdge(group, folder, RoleType.EDITOR))
+    g.add_edge(HasRoleEdge(group, org, RoleType.VIEWER))
+
+    batch = list(g.iter_user_permissions_many([user.id, group.id]))
+    assert len(batch) == len(set(batch))
+    for identity_id in (user.id, group.id):
+        assert {p for i, p in batch if i == identity_id} == \
+            set(g.iter_user_permissions(identity_id))
+
+    with pytest.raises(NodeNotFoundError):
+        list(g.iter_user_permissions_many([user.id, "ghost@test.com"]))
+
+
+def test_iter_user_permissions_many_nested_roots():
+    g = Graph()
+    nodes = [ResourceNode(f"folder_{i}", ResourceType.FOLDER)
+             for i in range(30)]
+    user = IdentityNode("adi@test.com", IdentityType.USER)
+    group = IdentityNode("admins", IdentityType.GROUP)
+    for node in [*nodes, user, group]:
+        g.add_node(node)
+    for parent, child in zip(nodes, nodes[1:]):
+        g.add_edge(ParentOfEdge(parent, child))
+    # grants on every level, deepest first
+    for node in reversed(nodes):
+        g.add_edge(HasRoleEdge(user, node, RoleType.OWNER))
+    g.add_edge(HasRoleEdge(group, nodes[10], RoleType.VIEWER))
+    g.add_edge(HasRoleEdge(group, nodes[5], RoleType.EDITOR))
+
+    batch = list(g.iter_user_permissions_many([user.id, group.id]))
+    assert len(batch) == len(set(batch)) == 30 + 20 + 25
+    for identity_id in (user.id, group.id):
+        assert {p for i, p in batch if i == identity_id} == \
+            set(g.iter_user_permissions(identity_id))
+
+
+def test_iter_user_permissions_many_duplicate_ids(graph):
+    g, *_, user = graph
+    traversed = list(g.iter_user_permissions_many([user.id, user.id]))
+    g.rebuild_permissions_index()
+    indexed = list(g.iter_user_permissions_many([user.id, user.id]))
+    assert len(traversed) == len(set(traversed)) == 2
+    assert set(indexed) == set(traversed) and len(indexed) == 2
+
+
+def test_permissions_index_tracks_new_edges():
+    def build(indexed):
+        g = Graph()
+        org = ResourceNode("org_1", ResourceType.ORGANIZATION)
+        folder = ResourceNode("folder_1", ResourceType.FOLDER)
+        project = ResourceNode("project_1", ResourceType.PROJECT)
+        user = IdentityNode("adi@test.com", IdentityType.USER)
+        for node in [org, folder, project, user]:
+            g.add_node(node)
+        g.add_edge(ParentOfEdge(org, folder))
+        g.add_edge(ParentOfEdge(folder, project))
+        g.add_edge(HasRoleEdge(user, folder, RoleType.OWNER))
+        if indexed:
+            g.rebuild_permissions_index()
+            g.clear_cache()
+
+        # new child under a granted resource inherits the role
+        task = ResourceNode("task_1", ResourceType.PROJECT)
+        g.add_node(task)
+        g.add_edge(ParentOfEdge(project, task))
+
+        # new identity and grant
+        group = IdentityNode("admins", IdentityType.GROUP)
+        g.add_node(group)
+        g.add_edge(HasRoleEdge(group, org, RoleType.VIEWER))
+        return g
+
+    indexed, plain = build(indexed=True), build(indexed=False)
+    assert indexed._descendants_cache == {}
+    assert {p.resource_id for p in indexed.iter_user_permissions("adi@test.com")} \
+        == {"folder_1", "project_1", "task_1"}
+    for identity_id in ("adi@test.com", "admins"):
+        assert set(indexed.iter_user_permissions(identity_id)) == \
+            set(plain.iter_user_permissions(identity_id))
+
+
+def test_permissions_index_allows_grants_while_iterating(graph):
+    g, org, _, _, user = graph
+    g.rebuild_permissions_index()
+    for _ in g.iter_user_permissions(user.id):
+        g.add_edge(HasRoleEdge(user, org, RoleType.VIEWER))
+    assert (org.id, RoleType.VIEWER) in \
+        {(p.resource_id, p.role) for p in g.iter_user_permissions(user.id)}
+
+
+def test_iter_user_permissions_debug_logging(caplog, graph):
+    g, _, folder, _, user = graph
+    with caplog.at_level(logging.DEBUG, logger="graph"):
+        list(g.iter_user_permissions(user.id))
+    assert f"User {user.id} has role OWNER on {folder.id}" \
+        in caplog.messages
+
+
 def test_iter_user_permissions_invalid_user(graph):
     g, *_ = graph
     with pytest.raises(NodeNotFoundError):
         list(g.iter_user_permissions("ghost@test.com"))
 
 
+# -------------------- Transitive closure --------------------
+
+@pytest.mark.parametrize("closure", [False, True])
+def test_is_descendant(graph, closure):
+    g, org, folder, project, user = graph
+    extra = ResourceNode("folder_2", ResourceType.FOLDER)
+    g.add_node(extra)
+    g.add_edge(ParentOfEdge(org, extra))
+    g.add_edge(ParentOfEdge(extra, project))
+    if closure:
+        g.build_closure()
+
+    assert g.is_descendant(project.id, org.id)
+    assert g.is_descendant(project.id, extra.id)
+    assert not g.is_descendant(org.id, project.id)
+    assert not g.is_descendant(org.id, org.id)
+    assert not g.is_descendant("ghost", org.id)
+    assert g._descendants_cache == {}
+    assert sorted(n.id for n in g._iter_descendants(org.id)) == \
+        ["folder_1", "folder_2", "project_1"]
+
+
+@pytest.mark.parametrize("closure", [False, True])
+def test_closure_with_cycle(graph, closure):
+    g, org, folder, project, _ = graph
+    g.add_edge(ParentOfEdge(project, folder))
+    g.add_edge(ParentOfEdge(org, org))
+    if closure:
+        g.build_closure()
+    assert g.is_descendant(folder.id, project.id)
+    assert g.is_descendant(project.id, folder.id)
+    assert g.is_descendant(folder.id, org.id)
+    # cycle members (including a self-loop) are their own descendants
+    assert g.is_descendant(folder.id, folder.id)
+    assert g.is_descendant(project.id, project.id)
+    assert g.is_descendant(org.id, org.id)
+    assert sorted(n.id for n in g._iter_descendants(org.id)) == \
+        ["folder_1", "project_1"]
+
+
+def test_closure_discarded_on_mutation(graph):
+    g, org, _, project, _ = graph
+    g.build_closure()
+    task = ResourceNode("task_1", ResourceType.PROJECT)
+    g.add_node(task)
+    assert g._closure == []
+    g.add_edge(ParentOfEdge(project, task))
+    assert g.is_descendant(task.id, org.id)
+
+
 # -------------------- Printing & String --------------------
 
 def test_graph_str(graph):
@@ -124,6 +426,7 @@ def test_graph_str(graph):
     result = str(g)
     assert "parent_of" in result
     assert "has_role" in result
+    assert result.splitlines()[0] == "org_1 -> [org_1 -[parent_of]-> folder_1]"
 
 
 def test_print_resource_tree(capsys, graph):
@@ -132,3 +435,28 @@ def test_print_resource_tree(capsys, graph):
     output = capsys.readouterr().out
     assert "org_1" in output
     assert "folder_1" in output
+    assert output.splitlines() == ["- org_1", "    - folder_1",
+                                   "        - project_1"]
+
+
+def test_print_resource_tree_self_loop(capsys, graph):
+    g, _, _, project, _ = graph
+    g.add_edge(ParentOfEdge(project, project))
+    g.print_resource_tree(project.id)
+    assert capsys.readouterr().out == "- project_1\n"
+
+
+def test_print_resource_tree_cycle(capsys, graph):
+    g, org, folder, project, _ = graph
+    g.add_edge(ParentOfEdge(project, org))
+    g.add_edge(ParentOfEdge(org, project))  # shared child, not a cycle by itself
+    g.print_resource_tree(org.id)
+    assert capsys.readouterr().out.splitlines() == [
+        "- org_1", "    - folder_1", "        - project_1", "    - project_1"]
+
+
+def test_print_resource_tree_wide_indent(capsys, graph):
+    g, _, folder, *_ = graph
+    g.print_resource_tree(folder.id, spaces=100)
+    output = capsys.readouterr().out
+    assert output == " " * 100 + "- folder_1\n" + " " * 104 + "- project_1\n"